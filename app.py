@@ -12,7 +12,10 @@ import random
 import io
 import re
 import uuid
+import threading
 import extra_streamlit_components as stx
+from gtts import gTTS
+from pydub.generators import Sine
 from PIL import Image
 
 # ==========================================
@@ -233,11 +236,16 @@ def get_user_preset(user_key, slot):
     db = load_json(PRESETS_FILE)
     return db.get(user_key, {}).get(str(slot), None)
 
+def preset_voice(pd):
+    # Older presets store the voice label under "vc_lbl"
+    return voice_label(pd.get("voice", pd.get("vc_lbl")))
+
 def apply_preset_to_line_callback(user_key, line_index, slot_id):
     pd = get_user_preset(user_key, slot_id)
     if not pd:
         return
-    st.session_state.line_settings[line_index]["voice"] = pd["voice"]
+    st.session_state.line_settings[line_index]["voice"] = preset_voice(pd)
+    st.session_state.line_settings[line_index]["eng"] = engine_label(pd.get("eng"))
     st.session_state.line_settings[line_index]["rate"] = pd["rate"]
     st.session_state.line_settings[line_index]["pitch"] = pd["pitch"]
     st.session_state.line_settings[line_index]["slot"] = slot_id
@@ -249,7 +257,8 @@ def apply_preset_to_line_bulk(user_key, line_index, slot_id):
     if not pd:
         return
     st.session_state.line_settings[line_index] = {
-        "voice": pd["voice"],
+        "voice": preset_voice(pd),
+        "eng": engine_label(pd.get("eng")),
         "rate": pd["rate"],
         "pitch": pd["pitch"],
         "slot": slot_id,
@@ -257,20 +266,237 @@ def apply_preset_to_line_bulk(user_key, line_index, slot_id):
     st.session_state[f"r{line_index}"] = pd["rate"]
     st.session_state[f"p{line_index}"] = pd["pitch"]
 
-async def gen_edge(text, voice, rate, pitch):
+BATCH_CONCURRENCY = 4
+VOICE_CACHE_TTL = 6 * 3600
+VOICE_FETCH_TIMEOUT = 5
+VOICE_RETRY_BACKOFF = 60
+
+@st.cache_data(ttl=VOICE_CACHE_TTL, show_spinner=False)
+def fetch_edge_voices():
+    # One network call per TTL window, shared by every session on this server.
+    # Errors propagate so a failed fetch is never cached.
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(
+            asyncio.wait_for(edge_tts.list_voices(), VOICE_FETCH_TIMEOUT)
+        )
+    finally:
+        loop.close()
+
+@st.cache_resource
+def voice_fetch_state():
+    # Shared across sessions so an outage costs one timeout per backoff window
+    return {"failed_at": 0.0}
+
+def edge_voices():
+    state = voice_fetch_state()
+    if time.time() - state["failed_at"] < VOICE_RETRY_BACKOFF:
+        return []
+    try:
+        return fetch_edge_voices()
+    except Exception as e:
+        print(f"Voice list unavailable: {e!r}")
+        state["failed_at"] = time.time()
+        return []
+
+def edge_voice_names():
+    return {v.get("ShortName") for v in edge_voices()}
+
+def check_voice(voice, names):
+    # names comes from edge_voice_names(), fetched once outside the event loop
+    if names and voice not in names:
+        raise Exception(f"Unknown voice: {voice}")
+
+def extend_voice_table(voices):
+    known = set(voices.values())
+    for v in edge_voices():
+        short = v.get("ShortName", "")
+        if short in known:
+            continue
+        if not (v.get("Locale") == "km-KH" or "Multilingual" in short):
+            continue
+        name = short.split("-")[-1].replace("Multilingual", "").replace("Neural", "")
+        voices[f"{name} ({v.get('Locale')})"] = short
+    return voices
+
+async def gen_edge(text, voice, rate, pitch, attempts=3):
     rate_str = f"{rate:+d}%" if rate != 0 else "+0%"
     pitch_str = f"{pitch:+d}Hz" if pitch != 0 else "+0Hz"
-    for attempt in range(3):
+    for attempt in range(attempts):
+        file_path = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3").name
+        ok = False
         try:
-            file_path = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3").name
             communicate = edge_tts.Communicate(text, voice, rate=rate_str, pitch=pitch_str)
             await communicate.save(file_path)
             if os.path.getsize(file_path) > 0:
+                ok = True
                 return file_path
         except Exception as e:
             print(f"Retry {attempt+1}: {e}")
-            time.sleep(1)
-    raise Exception("Failed after 3 attempts.")
+        finally:
+            # Also runs when the router's wait_for cancels us mid-stream
+            if not ok:
+                try:
+                    os.remove(file_path)
+                except:
+                    pass
+        if attempt + 1 < attempts:
+            await asyncio.sleep(1)
+    raise Exception(f"Failed after {attempts} attempts.")
+
+async def gen_gtts(text, voice, rate, pitch):
+    # gTTS only knows the language and a slow flag; pitch is not supported
+    lang = voice.split("-")[0]
+    file_path = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3").name
+    cancelled = threading.Event()
+
+    def save():
+        # The thread outlives a timed-out await, so it cleans up after itself
+        gTTS(text, lang=lang, slow=rate <= -25).save(file_path)
+        if cancelled.is_set() and os.path.exists(file_path):
+            os.remove(file_path)
+        return file_path
+
+    try:
+        return await asyncio.to_thread(save)
+    except BaseException:
+        cancelled.set()
+        try:
+            os.remove(file_path)
+        except:
+            pass
+        raise
+
+async def gen_local(text, voice, rate, pitch):
+    # Offline stand-in: a tone as long as the line would roughly take to read
+    ms = int(len(text) * 60 * 100 / (100 + rate))
+    tone = Sine(440 * 2 ** (pitch / 120)).to_audio_segment(duration=max(ms, 200)).apply_gain(-20)
+    file_path = tempfile.NamedTemporaryFile(delete=False, suffix=".wav").name
+    tone.export(file_path, format="wav")
+    return file_path
+
+ENGINES = {
+    "Edge-TTS": lambda *a: gen_edge(*a, attempts=1),
+    "gTTS": gen_gtts,
+    "Local (Offline)": gen_local,
+}
+DEFAULT_ENGINE = "Edge-TTS"
+
+def engine_label(name):
+    # Presets are hand-editable JSON; unknown engines fall back to the default
+    return name if name in ENGINES else DEFAULT_ENGINE
+FALLBACK_ENGINES = ["Edge-TTS", "gTTS"]
+ENGINE_RETRIES = 2
+# Edge-TTS fails fast under the router; a flaky line goes to the fallback
+ENGINE_ATTEMPTS = {"Edge-TTS": 1}
+ENGINE_TIMEOUT_BASE = 15
+ENGINE_TIMEOUT_PER_CHAR = 0.05
+HEALTH_WINDOW = 120
+SLOW_SECONDS_PER_100_CHARS = 5
+MAX_ERROR_RATE = 0.5
+MAX_CONSECUTIVE_FAILURES = 3
+FAILURE_COOLDOWN = 30
+
+def engine_timeout(text):
+    return ENGINE_TIMEOUT_BASE + len(text) * ENGINE_TIMEOUT_PER_CHAR
+
+@st.cache_resource
+def engine_health():
+    # Shared across sessions: engine -> [(timestamp, ok, seconds per 100 chars), ...]
+    # plus the current run of failures: engine -> (count, last failure time)
+    return {"lock": threading.Lock(), "samples": {}, "streak": {}}
+
+def record_engine(engine, ok, seconds, text):
+    # Short lines are dominated by the handshake, so count them as 100 chars
+    cost = seconds * 100 / max(len(text), 100)
+    h = engine_health()
+    now = time.time()
+    with h["lock"]:
+        samples = h["samples"].setdefault(engine, [])
+        samples.append((now, ok, cost))
+        samples[:] = [x for x in samples if now - x[0] < HEALTH_WINDOW]
+        count = h["streak"].get(engine, (0, 0.0))[0]
+        h["streak"][engine] = (0, 0.0) if ok else (count + 1, now)
+
+def engine_is_healthy(engine):
+    h = engine_health()
+    now = time.time()
+    with h["lock"]:
+        samples = [x for x in h["samples"].get(engine, []) if now - x[0] < HEALTH_WINDOW]
+        count, last_fail = h["streak"].get(engine, (0, 0.0))
+    # A fresh outage shows up here long before it moves the windowed error rate;
+    # after the cooldown one call is let through as a probe
+    if count >= MAX_CONSECUTIVE_FAILURES and now - last_fail < FAILURE_COOLDOWN:
+        return False
+    if len(samples) < 3:
+        return True
+    errors = sum(1 for _, ok, _ in samples if not ok)
+    if errors / len(samples) > MAX_ERROR_RATE:
+        return False
+    ok_times = [sec for _, ok, sec in samples if ok]
+    return not ok_times or sum(ok_times) / len(ok_times) <= SLOW_SECONDS_PER_100_CHARS
+
+def engine_route(engine):
+    order = [engine] + [e for e in FALLBACK_ENGINES if e != engine]
+    healthy = [e for e in order if engine_is_healthy(e)]
+    return healthy or order
+
+async def gen_tts(engine, text, voice, rate, pitch):
+    # Returns (path, engine that served it). Each engine gets its attempts
+    # while healthy, then the line moves on; it only fails once every engine
+    # in the route has been tried.
+    errors = []
+    for eng in engine_route(engine):
+        attempts = ENGINE_ATTEMPTS.get(eng, ENGINE_RETRIES)
+        for attempt in range(attempts):
+            start = time.time()
+            try:
+                path = await asyncio.wait_for(
+                    ENGINES[eng](text, voice, rate, pitch), engine_timeout(text)
+                )
+            except Exception as e:
+                record_engine(eng, False, time.time() - start, text)
+                print(f"{eng} retry {attempt+1}: {e!r}")
+                errors.append(f"{eng}: {e!r}")
+                if not engine_is_healthy(eng):
+                    break
+                if attempt + 1 < attempts:
+                    await asyncio.sleep(1)
+                continue
+            record_engine(eng, True, time.time() - start, text)
+            return path, eng
+    raise Exception("All engines failed. " + "; ".join(errors))
+
+async def gen_batch(jobs, on_done=None):
+    # Lines are independent requests (one websocket or HTTP call each), so
+    # keep several in flight instead of paying their latency back to back.
+    sem = asyncio.Semaphore(BATCH_CONCURRENCY)
+    results = [None] * len(jobs)
+    done = 0
+
+    async def run(i, job):
+        nonlocal done
+        async with sem:
+            results[i] = await gen_tts(*job)
+        done += 1
+        if on_done:
+            on_done(done, len(jobs))
+
+    tasks = [asyncio.ensure_future(run(i, job)) for i, job in enumerate(jobs)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for res in results:
+            if res:
+                try:
+                    os.remove(res[0])
+                except:
+                    pass
+        raise
+    return results
 
 def process_audio(file_path, pad_ms):
     try:
@@ -437,6 +663,12 @@ VOICES = {
     "Emma (EN Multi)": "en-US-EmmaMultilingualNeural",
     "William (EN AU Multi)": "en-AU-WilliamMultilingualNeural",
 }
+VOICES = extend_voice_table(VOICES)
+DEFAULT_VOICE = "Sreymom (Khmer)"
+
+def voice_label(label):
+    # Discovered voices can disappear between fetches; old presets must still load
+    return label if label in VOICES else DEFAULT_VOICE
 
 with st.sidebar:
     st.success(f"✅ Active: {st.session_state.days} Days")
@@ -449,21 +681,29 @@ with st.sidebar:
         
     st.divider()
     st.subheader("⚙️ Settings")
+    if "g_eng" not in st.session_state:
+        st.session_state.g_eng = DEFAULT_ENGINE
     if "g_voice" not in st.session_state:
-        st.session_state.g_voice = "Sreymom (Khmer)"
+        st.session_state.g_voice = DEFAULT_VOICE
     if "g_rate" not in st.session_state:
         st.session_state.g_rate = 0
     if "g_pitch" not in st.session_state:
         st.session_state.g_pitch = 0
 
+    e_sel = st.selectbox(
+        "Engine",
+        list(ENGINES.keys()),
+        index=list(ENGINES.keys()).index(engine_label(st.session_state.g_eng))
+    )
     v_sel = st.selectbox(
         "Voice",
         list(VOICES.keys()),
-        index=list(VOICES.keys()).index(st.session_state.g_voice)
+        index=list(VOICES.keys()).index(voice_label(st.session_state.g_voice))
     )
     r_sel = st.slider("Speed", -50, 50, value=st.session_state.g_rate)
     p_sel = st.slider("Pitch", -50, 50, value=st.session_state.g_pitch)
     pad_sel = st.number_input("Padding (ms)", value=80)
+    st.session_state.g_eng = e_sel
     st.session_state.g_voice = v_sel
     st.session_state.g_rate = r_sel
     st.session_state.g_pitch = p_sel
@@ -478,13 +718,14 @@ with st.sidebar:
         with c1p:
             if st.button(f"📂 {btn_name}", key=f"l{i}", use_container_width=True):
                 if saved_p:
-                    st.session_state.g_voice = saved_p["voice"]
+                    st.session_state.g_eng = engine_label(saved_p.get("eng"))
+                    st.session_state.g_voice = preset_voice(saved_p)
                     st.session_state.g_rate = saved_p["rate"]
                     st.session_state.g_pitch = saved_p["pitch"]
                     st.rerun()
         with c2p:
             if st.button("💾", key=f"s{i}", use_container_width=True):
-                data = {"voice": v_sel, "rate": r_sel, "pitch": p_sel}
+                data = {"eng": e_sel, "voice": v_sel, "rate": r_sel, "pitch": p_sel}
                 save_user_preset(st.session_state.ukey, i, data, preset_name_input)
                 st.toast(f"Saved Slot {i}!")
                 time.sleep(0.5)
@@ -508,9 +749,16 @@ with tab1:
         if txt:
             with st.spinner("Generating..."):
                 try:
+                    if e_sel == "Edge-TTS":
+                        check_voice(VOICES[v_sel], edge_voice_names())
                     loop = asyncio.new_event_loop()
                     asyncio.set_event_loop(loop)
-                    raw = loop.run_until_complete(gen_edge(txt, VOICES[v_sel], r_sel, p_sel))
+                    try:
+                        raw, used_eng = loop.run_until_complete(gen_tts(e_sel, txt, VOICES[v_sel], r_sel, p_sel))
+                    finally:
+                        loop.close()
+                    if used_eng != e_sel:
+                        st.warning(f"⚠️ {e_sel} unavailable, rendered with {used_eng}.")
                     final = process_audio(raw, pad_sel)
                     buf = io.BytesIO()
                     final.export(buf, format="mp3")
@@ -536,6 +784,7 @@ with tab2:
                 st.session_state.line_settings = [
                     {
                         "voice": st.session_state.g_voice,
+                        "eng": st.session_state.g_eng,
                         "rate": st.session_state.g_rate,
                         "pitch": st.session_state.g_pitch,
                         "slot": None,
@@ -660,27 +909,53 @@ with tab2:
                 try:
                     last_end = st.session_state.srt_lines[-1]["start"] + 10000
                     final_mix = AudioSegment.silent(duration=last_end)
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-
-                    total = len(st.session_state.srt_lines)
+                    jobs, starts, line_nos = [], [], []
                     for i, sub in enumerate(st.session_state.srt_lines):
-                        status.text(f"Processing {i+1}/{total}...")
                         sett = st.session_state.line_settings[i]
                         current_text = sub["text"]
                         if not current_text.strip():
                             continue
-                        raw_path = loop.run_until_complete(
-                            gen_edge(current_text, VOICES[sett["voice"]], sett["rate"], sett["pitch"])
+                        voice = VOICES[voice_label(sett["voice"])]
+                        jobs.append((engine_label(sett.get("eng")), current_text, voice, sett["rate"], sett["pitch"]))
+                        starts.append(sub["start"])
+                        line_nos.append(i + 1)
+                    edge_voices_used = {job[2] for job in jobs if job[0] == "Edge-TTS"}
+                    if edge_voices_used:
+                        names = edge_voice_names()
+                        for voice in edge_voices_used:
+                            check_voice(voice, names)
+
+                    loop = asyncio.new_event_loop()
+                    asyncio.set_event_loop(loop)
+                    try:
+                        results = loop.run_until_complete(
+                            gen_batch(
+                                jobs,
+                                on_done=lambda n, total: status.text(f"Processing {n}/{total}..."),
+                            )
                         )
-                        clip = AudioSegment.from_file(raw_path)
-                        final_mix = final_mix.overlay(clip, position=sub["start"])
-                        try:
-                            os.remove(raw_path)
-                        except:
-                            pass
+                    finally:
+                        loop.close()
+                    raw_paths = [path for path, _ in results]
+                    try:
+                        for raw_path, start in zip(raw_paths, starts):
+                            clip = AudioSegment.from_file(raw_path)
+                            final_mix = final_mix.overlay(clip, position=start)
+                    finally:
+                        for raw_path in raw_paths:
+                            try:
+                                os.remove(raw_path)
+                            except:
+                                pass
 
                     status.success("Done!")
+                    swapped = [
+                        f"#{n} ({used})"
+                        for n, job, (_, used) in zip(line_nos, jobs, results)
+                        if used != job[0]
+                    ]
+                    if swapped:
+                        st.warning("⚠️ Rendered by a fallback engine: " + ", ".join(swapped))
                     buf = io.BytesIO()
                     final_mix.export(buf, format="mp3")
                     buf.seek(0)